@@ -1,29 +1,190 @@
 import streamlit as st
 import sqlite3
+import csv
 import hashlib
+import hmac
+import io
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
 import pandas as pd
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------
+# SQL Statements
+# ----------------------------------
+# Hot-path queries share one text each so they hit the statement cache
+SQL_GET_ADMIN_PASSWORD = "SELECT password FROM admin WHERE username = ? LIMIT 1"
+SQL_SET_ADMIN_PASSWORD = "UPDATE admin SET password = ? WHERE username = ?"
+# LIMIT 2 so a roll registered twice, differing only in letter case or
+# surrounding spaces, shows up as ambiguous
+SQL_GET_VOLUNTEER_BY_ROLL = "SELECT id, name FROM volunteers WHERE trim(roll_number) = ? COLLATE NOCASE LIMIT 2"
+SQL_VOTED_POSITIONS = "SELECT position FROM votes WHERE volunteer_id = ?"
+SQL_INSERT_VOTE = "INSERT OR IGNORE INTO votes (volunteer_id, candidate_id, position) VALUES (?, ?, ?)"
+# The NOT EXISTS keeps case and whitespace variants of a stored roll out,
+# which the unique indexes alone do not
+SQL_INSERT_VOLUNTEER = ("INSERT OR IGNORE INTO volunteers (name, roll_number, year, branch) "
+                        "SELECT ?1, ?2, ?3, ?4 "
+                        "WHERE NOT EXISTS (SELECT 1 FROM volunteers WHERE trim(roll_number) = ?2 COLLATE NOCASE)")
+SQL_INSERT_CANDIDATE = "INSERT INTO candidates (name, roll_number, year, branch, position1, position2) VALUES (?, ?, ?, ?, ?, ?)"
+# Skips the photo if the candidate was removed before the write ran
+SQL_INSERT_CANDIDATE_PHOTO = ("INSERT INTO candidate_photos (candidate_id, photo) "
+                              "SELECT id, ? FROM candidates WHERE id = ?")
+# One row per (position, candidate): UNION drops a candidate listed twice for
+# one position, and blank positions are filtered and the rest sorted in SQL
+SQL_BALLOT_CANDIDATES = (
+    "SELECT p.position, c.id, c.name, c.roll_number FROM ("
+    "SELECT id, position1 AS position FROM candidates "
+    "UNION "
+    "SELECT id, position2 FROM candidates"
+    ") p JOIN candidates c ON c.id = p.id "
+    "WHERE p.position IS NOT NULL AND p.position != '' "
+    "ORDER BY p.position, c.id"
+)
+# Counts off the covering votes(position, candidate_id) index; join names afterwards
+SQL_TALLY = "SELECT position, candidate_id, COUNT(*) AS votes FROM votes GROUP BY position, candidate_id"
+SQL_VOLUNTEERS_EXPORT = "SELECT id, name, roll_number, year, branch FROM volunteers"
+SQL_CANDIDATES_EXPORT = "SELECT name, roll_number, year, branch, position1, position2 FROM candidates"
+SQL_VOTES_EXPORT = (
+    "SELECT v.roll_number AS volunteer_roll, c.name AS candidate_name, vt.position AS position "
+    "FROM votes vt "
+    "JOIN volunteers v ON vt.volunteer_id = v.id "
+    "JOIN candidates c ON vt.candidate_id = c.id"
+)
 
 # ----------------------------------
 # DB Helpers
 # ----------------------------------
+@st.cache_resource
 def get_db_connection():
-    conn = sqlite3.connect('nss_election.db')
+    # One connection per process, shared by every session and rerun.
+    conn = sqlite3.connect('nss_election.db', check_same_thread=False, isolation_level=None,
+                           cached_statements=256)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    apply_pragmas(conn, WRITER_CACHE_KIB)
     return conn
 
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+READ_POOL_SIZE = 4
+# Page cache per connection, in KiB. Each reader gets a smaller one so the
+# pool doesn't hold READ_POOL_SIZE copies of the writer's cache.
+WRITER_CACHE_KIB = 65536
+READER_CACHE_KIB = 16384
+
+@st.cache_resource
+def get_read_pool():
+    # Reader connections, so SELECTs don't queue behind the writer under WAL
+    pool = queue.Queue()
+    for _ in range(READ_POOL_SIZE):
+        conn = sqlite3.connect('nss_election.db', check_same_thread=False, isolation_level=None,
+                               cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        apply_pragmas(conn, READER_CACHE_KIB)
+        conn.execute("PRAGMA query_only=ON")
+        pool.put(conn)
+    return pool
+
+@contextmanager
+def read_connection():
+    pool = get_read_pool()
+    conn = pool.get()
+    try:
+        yield conn
+    finally:
+        pool.put(conn)
+
+def apply_pragmas(conn, cache_kib):
+    # Per-connection settings shared by the writer and the readers; WAL and
+    # synchronous are set on the writer alone
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA cache_size=-{cache_kib}")
+    conn.execute("PRAGMA mmap_size=268435456")
+
+@st.cache_resource
+def get_db_lock():
+    # Guards multi-statement transactions on the shared connection.
+    return threading.RLock()
+
+@st.cache_resource
+def get_table_versions():
+    # Bumped after every committed write to the table
+    return {"admin": 0, "volunteers": 0, "candidates": 0, "votes": 0}
+
+def bump_versions(*tables):
+    versions = get_table_versions()
+    with get_db_lock():
+        for table in tables:
+            versions[table] += 1
+
+def versioned(*tables):
+    # Passes the current versions of tables as the cached function's first
+    # argument. A reader that queried before a write stores its result under
+    # the old versions, which no call after the write asks for again.
+    def deco(cached):
+        @wraps(cached)
+        def wrapper(*args, **kwargs):
+            versions = get_table_versions()
+            return cached(tuple(versions[table] for table in tables), *args, **kwargs)
+        wrapper.clear = cached.clear
+        return wrapper
+    return deco
+
+@contextmanager
+def txn(conn):
+    with get_db_lock():
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+def with_cursor(write=False, on_commit=None):
+    # Passes a cursor as the first argument: write helpers get the shared
+    # writer inside txn() so they commit or roll back as a unit, readers
+    # borrow a connection from the read pool. on_commit runs after COMMIT;
+    # it bumps the table versions that the cached readers are keyed on.
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if write:
+                conn = get_db_connection()
+                with txn(conn):
+                    result = fn(conn.cursor(), *args, **kwargs)
+                if on_commit:
+                    on_commit()
+                return result
+            with read_connection() as conn:
+                return fn(conn.cursor(), *args, **kwargs)
+        return wrapper
+    return deco
+
+def hash_password(password, salt=None):
+    # Salted scrypt, stored as "scrypt$<salt>$<digest>"
+    salt = salt or os.urandom(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=2**14, r=8, p=1)
+    return f"scrypt${salt.hex()}${digest.hex()}"
+
+def verify_password(password, stored):
+    if stored.startswith("scrypt$"):
+        salt = bytes.fromhex(stored.split("$")[1])
+        return hmac.compare_digest(stored, hash_password(password, salt))
+    # Databases created before scrypt hold an unsalted SHA-256 hex digest
+    return hmac.compare_digest(stored, hashlib.sha256(password.encode()).hexdigest())
 
 def create_tables():
     conn = get_db_connection()
     c = conn.cursor()
     
-    c.execute('''CREATE TABLE IF NOT EXISTS admin (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT UNIQUE,
-    password TEXT
-    )''')
-
     c.execute('''CREATE TABLE IF NOT EXISTS admin (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         username TEXT UNIQUE,
@@ -33,7 +194,7 @@ def create_tables():
     c.execute('''CREATE TABLE IF NOT EXISTS volunteers (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT,
-        roll_number TEXT UNIQUE,
+        roll_number TEXT UNIQUE COLLATE NOCASE,
         year TEXT,
         branch TEXT
     )''')
@@ -45,10 +206,26 @@ def create_tables():
         year TEXT,
         branch TEXT,
         position1 TEXT,
-        position2 TEXT,
-        photo BLOB
+        position2 TEXT
     )''')
 
+    # Photos are kept out of the candidates rows so candidate scans stay small
+    c.execute('''CREATE TABLE IF NOT EXISTS candidate_photos (
+        candidate_id INTEGER PRIMARY KEY,
+        photo BLOB,
+        FOREIGN KEY (candidate_id) REFERENCES candidates(id)
+    )''')
+
+    # Databases created earlier still carry candidates.photo; move it across.
+    # The emptied column is left in place: DROP COLUMN needs SQLite 3.35+,
+    # and the bullseye image ships 3.34.
+    columns = [row['name'] for row in c.execute("PRAGMA table_info(candidates)").fetchall()]
+    if "photo" in columns:
+        with txn(conn):
+            c.execute("INSERT OR IGNORE INTO candidate_photos (candidate_id, photo) "
+                      "SELECT id, photo FROM candidates WHERE photo IS NOT NULL")
+            c.execute("UPDATE candidates SET photo = NULL WHERE photo IS NOT NULL")
+
     c.execute('''CREATE TABLE IF NOT EXISTS votes (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         volunteer_id INTEGER,
@@ -58,120 +235,337 @@ def create_tables():
         FOREIGN KEY (candidate_id) REFERENCES candidates(id)
     )''')
 
-    conn.commit()
-    conn.close()
-
-def create_admin():
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM admin")
+    # One vote per volunteer per position, enforced by the database. Older
+    # databases may hold duplicates from the check-then-insert race; the
+    # first vote cast for each pair is kept.
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_votes_volunteer_position'")
+    if not c.fetchone():
+        with txn(conn):
+            first_votes = "SELECT MIN(id) FROM votes GROUP BY volunteer_id, position"
+            c.execute(f"SELECT COUNT(*) FROM votes WHERE id NOT IN ({first_votes})")
+            duplicates = c.fetchone()[0]
+            if duplicates:
+                logger.warning("Removing %d duplicate votes (same volunteer and position) "
+                               "before enforcing one vote per position", duplicates)
+                c.execute(f"DELETE FROM votes WHERE id NOT IN ({first_votes})")
+            c.execute("CREATE UNIQUE INDEX idx_votes_volunteer_position ON votes(volunteer_id, position)")
+
+    # The old form stored roll numbers unstripped, and login now strips what
+    # is typed. Trim them here unless that would clash with another row.
+    with txn(conn):
+        c.execute("UPDATE volunteers SET roll_number = trim(roll_number) "
+                  "WHERE roll_number != trim(roll_number) AND NOT EXISTS ("
+                  "SELECT 1 FROM volunteers o WHERE o.id != volunteers.id "
+                  "AND trim(o.roll_number) = trim(volunteers.roll_number) COLLATE NOCASE)")
+        c.execute("SELECT roll_number FROM volunteers WHERE roll_number != trim(roll_number)")
+        untrimmed = [row[0] for row in c.fetchall()]
+    if untrimmed:
+        # The admin panel lists them and their login is refused
+        logger.warning("Roll numbers left untrimmed because the trimmed value is already registered: %s",
+                       ", ".join(repr(roll) for roll in untrimmed))
+
+    # Databases created before COLLATE NOCASE only have a case-sensitive UNIQUE
+    # on roll_number, so they need a NOCASE index of their own
+    c.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'volunteers'")
+    if "COLLATE NOCASE" in c.fetchone()[0].upper():
+        # The column's own UNIQUE autoindex already is one
+        c.execute("DROP INDEX IF EXISTS idx_volunteers_roll_nocase")
+        c.execute("DROP INDEX IF EXISTS idx_volunteers_roll_nocase_unique")
+    else:
+        try:
+            c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_volunteers_roll_nocase_unique "
+                      "ON volunteers(roll_number COLLATE NOCASE)")
+            c.execute("DROP INDEX IF EXISTS idx_volunteers_roll_nocase")
+        except sqlite3.IntegrityError:
+            # Case variants are already registered. Keep a plain index for
+            # lookups; the admin panel lists them and their login is refused.
+            c.execute("CREATE INDEX IF NOT EXISTS idx_volunteers_roll_nocase "
+                      "ON volunteers(roll_number COLLATE NOCASE)")
+            logger.warning("Roll numbers registered in more than one letter case: %s",
+                           ", ".join(get_ambiguous_rolls()))
+
+    # Login and the ambiguity check match on the trimmed roll
+    c.execute("CREATE INDEX IF NOT EXISTS idx_volunteers_roll_trim "
+              "ON volunteers(trim(roll_number) COLLATE NOCASE)")
+
+    # Lets the vote tallies group straight off the index instead of sorting
+    c.execute("CREATE INDEX IF NOT EXISTS idx_votes_position_candidate ON votes(position, candidate_id)")
+
+@with_cursor(write=True)
+def insert_default_admin(c, password_hash):
+    c.execute("SELECT 1 FROM admin LIMIT 1")
     if not c.fetchone():
         c.execute("INSERT INTO admin (username, password) VALUES (?, ?)", 
-                  ('admin', hash_password('admin123')))
-        conn.commit()
-    conn.close()
-    
-def admin_login(username, password):
-    c.execute("SELECT * FROM admin WHERE username=? AND password=?", (username, password))
-    return c.fetchone()    
+                  ('admin', password_hash))
 
-def check_admin_credentials(username, password):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM admin WHERE username = ? AND password = ?", 
-              (username, hash_password(password)))
-    result = c.fetchone()
-    conn.close()
-    return result
+def create_admin():
+    # scrypt runs before the write lock is taken, so ballots don't wait on it
+    insert_default_admin(hash_password('admin123'))
 
-def get_volunteer_by_roll(roll_number):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM volunteers WHERE roll_number = ?", (roll_number,))
-    result = c.fetchone()
-    conn.close()
-    return result
+@st.cache_resource
+def init_db():
+    # Schema and default admin are set up once per process, not per rerun
+    create_tables()
+    create_admin()
+    # Refresh planner statistics so the indexes above are picked up
+    get_db_connection().execute("ANALYZE")
+    return True
+    
+@versioned("admin")
+@st.cache_data(max_entries=32)
+def get_admin_password_hash(version, username):
+    # Admin rows only change when a legacy hash is upgraded, which clears this
+    with read_connection() as conn:
+        row = conn.execute(SQL_GET_ADMIN_PASSWORD, (username,)).fetchone()
+    return row['password'] if row else None
 
-def has_voted(volunteer_id, position):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM votes WHERE volunteer_id = ? AND position = ?", 
-              (volunteer_id, position))
-    result = c.fetchone()
-    conn.close()
-    return result is not None
+def clear_admin_caches():
+    bump_versions("admin")
+    get_admin_password_hash.clear()
 
-def submit_vote(volunteer_id, candidate_id, position):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("INSERT INTO votes (volunteer_id, candidate_id, position) VALUES (?, ?, ?)", 
-              (volunteer_id, candidate_id, position))
-    conn.commit()
-    conn.close()
+@with_cursor(write=True, on_commit=clear_admin_caches)
+def store_admin_password_hash(c, username, password_hash):
+    c.execute(SQL_SET_ADMIN_PASSWORD, (password_hash, username))
 
-def get_unique_positions():
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute(
-        "SELECT DISTINCT position1 FROM candidates WHERE position1 IS NOT NULL "
-        "UNION "
-        "SELECT DISTINCT position2 FROM candidates WHERE position2 IS NOT NULL"
-    )
-    positions = [row[0] for row in c.fetchall() if row[0]]
-    conn.close()
-    return sorted(positions)
-
-def get_votes_csv():
-    conn = get_db_connection()
-    query = '''
-        SELECT 
-            v.roll_number AS volunteer_roll,
-            c.name AS candidate_name,
-            vt.position AS position
-        FROM votes vt
-        JOIN volunteers v ON vt.volunteer_id = v.id
-        JOIN candidates c ON vt.candidate_id = c.id
-    '''
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
-
-def get_all_volunteers():
-    conn = get_db_connection()
-    df = pd.read_sql_query("SELECT * FROM volunteers", conn)
-    conn.close()
-    return df
+def set_admin_password(username, password):
+    store_admin_password_hash(username, hash_password(password))
 
-def get_all_candidates():
-    conn = get_db_connection()
-    df = pd.read_sql_query("SELECT name, roll_number, year,branch, position1, position2 FROM candidates", conn)
-    conn.close()
-    return df
-
-def get_vote_counts():
-    conn = get_db_connection()
-    df = pd.read_sql_query("""
-        SELECT c.name AS candidate, vt.position, COUNT(*) AS votes
-        FROM votes vt
-        JOIN candidates c ON vt.candidate_id = c.id
-        GROUP BY vt.candidate_id, vt.position
-    """, conn)
-    conn.close()
-    return df
-
-def remove_volunteer(roll):
-    conn = get_db_connection()
-    c = conn.cursor()
+def check_admin_credentials(username, password):
+    stored = get_admin_password_hash(username)
+    if stored is None or not verify_password(password, stored):
+        return False
+    if not stored.startswith("scrypt$"):
+        # Move a legacy SHA-256 hash to scrypt now that the password is known.
+        # The upgrade is opportunistic; a busy database just retries next login.
+        try:
+            set_admin_password(username, password)
+        except sqlite3.Error:
+            logger.warning("Could not upgrade the password hash for admin %s", username, exc_info=True)
+    return True
+
+@with_cursor()
+def get_volunteers_by_roll(c, roll_number):
+    # At most two rows; more than one means the roll is ambiguous
+    c.execute(SQL_GET_VOLUNTEER_BY_ROLL, (roll_number,))
+    return c.fetchall()
+
+class VoteConflict(Exception):
+    pass
+
+@with_cursor(write=True)
+def insert_ballot(c, volunteer_id, votes):
+    c.executemany(SQL_INSERT_VOTE, [(volunteer_id, candidate_id, pos) for pos, candidate_id in votes.items()])
+    if c.rowcount != len(votes):
+        raise VoteConflict
+
+@with_cursor()
+def get_voted_positions(c, volunteer_id):
+    c.execute(SQL_VOTED_POSITIONS, (volunteer_id,))
+    return {row[0] for row in c.fetchall()}
+
+def submit_ballot(volunteer_id, votes):
+    # Records every position or none; returns the positions already voted for
+    try:
+        insert_ballot(volunteer_id, votes)
+    except VoteConflict:
+        voted = get_voted_positions(volunteer_id)
+        return [pos for pos in votes if pos in voted]
+    clear_vote_caches()
+    return []
+
+def query_df(query, params=()):
+    with read_connection() as conn:
+        c = conn.cursor()
+        c.row_factory = None
+        c.execute(query, params)
+        return pd.DataFrame.from_records(c.fetchall(), columns=[d[0] for d in c.description])
+
+def query_csv(query, params=(), chunk_size=5000):
+    # Streams rows into the CSV buffer without building a DataFrame
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    with read_connection() as conn:
+        c = conn.cursor()
+        c.row_factory = None
+        c.execute(query, params)
+        writer.writerow([d[0] for d in c.description])
+        rows = c.fetchmany(chunk_size)
+        while rows:
+            writer.writerows(rows)
+            rows = c.fetchmany(chunk_size)
+    return buf.getvalue().encode()
+
+@versioned("candidates")
+@st.cache_data(ttl=300)
+def get_ballot(version):
+    # {position: candidates} for the voting page, shared by every session.
+    # Positions come from the same rowset, so none is left without candidates.
+    with read_connection() as conn:
+        rows = conn.execute(SQL_BALLOT_CANDIDATES).fetchall()
+    ballot = {}
+    for row in rows:
+        cand = {"id": row["id"], "name": row["name"], "roll_number": row["roll_number"]}
+        ballot.setdefault(row["position"], []).append(cand)
+    return ballot
+
+@versioned("volunteers")
+@st.cache_data(ttl=300)
+def get_ambiguous_rolls(version):
+    # Rolls registered more than once in different letter case (pre-NOCASE
+    # databases) or with surrounding spaces (rows the old form never stripped).
+    # Quoted so the spaces show.
+    with read_connection() as conn:
+        rows = conn.execute(
+            "SELECT group_concat(quote(roll_number), ' / ') FROM volunteers "
+            "GROUP BY trim(roll_number) COLLATE NOCASE HAVING COUNT(*) > 1"
+        ).fetchall()
+    return [row[0] for row in rows]
+
+@versioned("volunteers")
+@st.cache_data(ttl=300)
+def list_volunteer_rolls(version):
+    with read_connection() as conn:
+        rows = conn.execute("SELECT roll_number FROM volunteers ORDER BY roll_number").fetchall()
+    return [row[0] for row in rows]
+
+@versioned("candidates")
+@st.cache_data(ttl=300)
+def list_candidate_labels(version):
+    # {roll_number: "name (branch)"} for the remove-candidate picker
+    with read_connection() as conn:
+        rows = conn.execute("SELECT roll_number, name, branch FROM candidates ORDER BY roll_number").fetchall()
+    return {roll: f"{name} ({branch})" for roll, name, branch in rows}
+
+# Bumping the versions is what keeps readers off stale data; clearing only
+# drops the superseded entries before their TTL runs out
+def clear_volunteer_caches():
+    bump_versions("volunteers")
+    get_volunteers_csv.clear()
+    get_volunteers_parquet.clear()
+    list_volunteer_rolls.clear()
+    get_ambiguous_rolls.clear()
+    clear_vote_caches()
+
+def clear_candidate_caches():
+    bump_versions("candidates")
+    get_ballot.clear()
+    get_candidates_csv.clear()
+    get_candidates_parquet.clear()
+    list_candidate_labels.clear()
+    clear_vote_caches()
+
+def clear_vote_caches():
+    bump_versions("votes")
+    get_votes_csv.clear()
+    get_votes_parquet.clear()
+    get_live_vote_counts.clear()
+
+@versioned("volunteers", "candidates", "votes")
+@st.cache_data(ttl=300)
+def get_votes_csv(version):
+    return query_csv(SQL_VOTES_EXPORT)
+
+@versioned("volunteers", "candidates", "votes")
+@st.cache_data(ttl=300)
+def get_votes_parquet(version):
+    return query_df(SQL_VOTES_EXPORT).to_parquet(index=False)
+
+@versioned("volunteers")
+@st.cache_data(ttl=300)
+def get_volunteers_csv(version):
+    return query_csv(SQL_VOLUNTEERS_EXPORT)
+
+@versioned("volunteers")
+@st.cache_data(ttl=300)
+def get_volunteers_parquet(version):
+    return query_df(SQL_VOLUNTEERS_EXPORT).to_parquet(index=False)
+
+@versioned("candidates")
+@st.cache_data(ttl=300)
+def get_candidates_csv(version):
+    return query_csv(SQL_CANDIDATES_EXPORT)
+
+@versioned("candidates")
+@st.cache_data(ttl=300)
+def get_candidates_parquet(version):
+    return query_df(SQL_CANDIDATES_EXPORT).to_parquet(index=False)
+
+@with_cursor(write=True, on_commit=clear_volunteer_caches)
+def add_volunteer(c, name, roll_number, year, branch):
+    # False if the roll number is already registered
+    c.execute(SQL_INSERT_VOLUNTEER, (name, roll_number, year, branch))
+    return c.rowcount == 1
+
+@with_cursor(write=True, on_commit=clear_volunteer_caches)
+def add_volunteers_bulk(c, rows):
+    # rows of stripped (name, roll_number, year, branch), inserted in one transaction
+    c.executemany(SQL_INSERT_VOLUNTEER, rows)
+    return c.rowcount
+
+@with_cursor(write=True, on_commit=clear_candidate_caches)
+def add_candidate(c, name, roll_number, year, branch, position1, position2):
+    c.execute(SQL_INSERT_CANDIDATE, (name, roll_number, year, branch, position1, position2))
+    return c.lastrowid
+
+@with_cursor(write=True, on_commit=clear_volunteer_caches)
+def remove_volunteer(c, roll):
     c.execute("DELETE FROM volunteers WHERE roll_number = ?", (roll,))
-    conn.commit()
-    conn.close()
 
-def remove_candidate(roll):
-    conn = get_db_connection()
-    c = conn.cursor()
+@with_cursor(write=True, on_commit=clear_candidate_caches)
+def remove_candidate(c, roll):
+    c.execute("DELETE FROM candidate_photos WHERE candidate_id IN "
+              "(SELECT id FROM candidates WHERE roll_number = ?)", (roll,))
     c.execute("DELETE FROM candidates WHERE roll_number = ?", (roll,))
-    conn.commit()
-    conn.close()
+
+# ----------------------------------
+# Photo Helpers
+# ----------------------------------
+def encode_photo(upload):
+    # Store a small WebP instead of the raw upload
+    # Apply the EXIF rotation first; re-encoding would otherwise drop it
+    img = ImageOps.exif_transpose(Image.open(upload))
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA")
+    img.thumbnail((320, 320))
+    buf = io.BytesIO()
+    img.save(buf, "WEBP", quality=85, method=6)
+    return buf.getvalue()
+
+@st.cache_resource
+def get_photo_pool():
+    # One worker, so photo writes queue behind each other
+    return ThreadPoolExecutor(max_workers=1)
+
+@with_cursor(write=True)
+def save_candidate_photo(c, candidate_id, photo_bytes):
+    c.execute(SQL_INSERT_CANDIDATE_PHOTO, (photo_bytes, candidate_id))
+
+def store_candidate_photo(candidate_id, raw):
+    save_candidate_photo(candidate_id, encode_photo(io.BytesIO(raw)))
+
+@st.cache_resource
+def get_photo_failures():
+    # {candidate roll: error} for background saves that failed, shown on the admin panel
+    return {}
+
+def queue_candidate_photo(candidate_id, raw, roll):
+    # Encoding and writing the photo happen off the request thread
+    failures = get_photo_failures()
+
+    def report(future):
+        exc = future.exception()
+        if exc is not None:
+            # The traceback goes to the log; the admin gets a short reason
+            logger.error("Saving photo for candidate %s failed", roll, exc_info=exc)
+            if isinstance(exc, OSError):
+                # Covers UnidentifiedImageError and truncated files
+                failures[roll] = "not a valid image"
+            elif isinstance(exc, sqlite3.Error):
+                failures[roll] = "the database could not store it"
+            else:
+                failures[roll] = "an unexpected error occurred (see the server log)"
+
+    get_photo_pool().submit(store_candidate_photo, candidate_id, raw).add_done_callback(report)
 
 # ----------------------------------
 # Session State Initialization
@@ -209,19 +603,17 @@ def admin_login_page():
             st.error("❌ Invalid username or password")
 
 
-def get_live_vote_counts():
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("""
-        SELECT vt.position, c.name, COUNT(vt.id) as votes
-        FROM votes vt
-        JOIN candidates c ON vt.candidate_id = c.id
-        GROUP BY vt.position, c.id
-        ORDER BY vt.position, votes DESC
-    """)
-    results = c.fetchall()
-    conn.close()
-    return results
+@versioned("candidates", "votes")
+@st.cache_data(ttl=300)
+def get_live_vote_counts(version):
+    with read_connection() as conn:
+        rows = conn.execute("""
+            SELECT t.position, c.name, t.votes
+            FROM (""" + SQL_TALLY + """) t
+            JOIN candidates c ON t.candidate_id = c.id
+            ORDER BY t.position, t.votes DESC
+        """).fetchall()
+    return [tuple(row) for row in rows]
 # ----------------------------------
 # Admin Panel Page
 # ----------------------------------
@@ -230,6 +622,12 @@ def admin_panel_page():
     st.write(f"Welcome, **{st.session_state.admin_user}**")
     branches = ["CSE", "EEE", "MECH", "AI&ML", "AI&DS", "CSD", "EIE", "CIVIL", "ECE", "IT"]
 
+    ambiguous = get_ambiguous_rolls()
+    if ambiguous:
+        st.warning("These roll numbers are registered more than once, differing only in letter case "
+                   "or surrounding spaces, and cannot log in until the extra entries are removed: "
+                   + ", ".join(ambiguous))
+
     # Volunteer Add Section
     st.subheader("👥 Add Volunteer")
     with st.form("add_volunteer_form", clear_on_submit=True):
@@ -239,19 +637,41 @@ def admin_panel_page():
         branch = st.selectbox("Branch", branches)
         submitted_vol = st.form_submit_button("Add Volunteer")
         if submitted_vol:
-            conn = get_db_connection()
-            c = conn.cursor()
-            try:
-                c.execute("INSERT INTO volunteers (name, roll_number, year, branch) VALUES (?, ?, ?, ?)",
-                          (name, roll_number, year, branch))
-                conn.commit()
-                st.success("Volunteer added successfully")
-            except Exception as e:
-                st.error(f"Error: {e}")
-            conn.close()
+            name, roll_number = name.strip(), roll_number.strip()
+            if not name or not roll_number:
+                st.error("Name and roll number are required")
+            else:
+                try:
+                    if add_volunteer(name, roll_number, year, branch):
+                        st.success("Volunteer added successfully")
+                    else:
+                        st.error(f"A volunteer with roll number {roll_number} already exists")
+                except sqlite3.Error as e:
+                    st.error(f"Error: {e}")
+
+    # Volunteer CSV Import Section
+    st.subheader("📥 Import Volunteers")
+    vol_file = st.file_uploader("Volunteers CSV (name, roll_number, year, branch)", type=["csv"])
+    if vol_file and st.button("Import Volunteers"):
+        try:
+            dfimport = pd.read_csv(vol_file, dtype=str).fillna("")
+            cols = dfimport[["name", "roll_number", "year", "branch"]].apply(lambda col: col.str.strip())
+            valid = cols[(cols["name"] != "") & (cols["roll_number"] != "")]
+            added = add_volunteers_bulk(list(valid.itertuples(index=False, name=None)))
+            st.success(f"Imported {added} of {len(cols)} volunteers")
+            if len(valid) < len(cols):
+                st.warning(f"Skipped {len(cols) - len(valid)} rows with a blank name or roll number")
+        except Exception as e:
+            st.error(f"Error: {e}")
 
     # Candidate Add Section
     st.subheader("🧑‍💼 Add Candidate")
+    photo_failures = get_photo_failures()
+    for roll in list(photo_failures):
+        # Shared across sessions, so another admin page may have shown it already
+        error = photo_failures.pop(roll, None)
+        if error is not None:
+            st.warning(f"Photo for candidate {roll} could not be saved: {error}")
     with st.form("add_candidate_form", clear_on_submit=True):
         cname = st.text_input("Candidate Name")
         croll = st.text_input("Candidate Roll Number")
@@ -262,17 +682,17 @@ def admin_panel_page():
         photo = st.file_uploader("Upload Photo", type=["jpg", "jpeg", "png"])
         submitted_cand = st.form_submit_button("Add Candidate")
         if submitted_cand:
-            conn = get_db_connection()
-            c = conn.cursor()
             try:
-                photo_bytes = photo.read() if photo else None
-                c.execute("INSERT INTO candidates (name, roll_number, year, branch, position1, position2, photo) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                          (cname, croll, cyear, cbranch, position1, position2, photo_bytes))
-                conn.commit()
+                raw_photo = photo.getvalue() if photo else None
+                if raw_photo:
+                    # Reads only the header, so bad files are rejected before the insert
+                    Image.open(io.BytesIO(raw_photo))
+                candidate_id = add_candidate(cname, croll, cyear, cbranch, position1, position2)
+                if raw_photo:
+                    queue_candidate_photo(candidate_id, raw_photo, croll)
                 st.success("Candidate added successfully")
             except Exception as e:
                 st.error(f"Error: {e}")
-            conn.close()
     
         st.subheader("Live Vote Counts")
         vote_counts = get_live_vote_counts()
@@ -291,25 +711,30 @@ def admin_panel_page():
     col1, col2, col3 = st.columns(3)
     with col1:
         st.markdown("### Volunteers")
-        dfv = get_all_volunteers()
-        st.download_button("Download Volunteers", dfv.to_csv(index=False), "volunteers.csv")
+        st.download_button("Download Volunteers", get_volunteers_csv(), "volunteers.csv")
     with col2:
         st.markdown("### Candidates")
-        dfc = get_all_candidates()
-        st.download_button("Download Candidates", dfc.to_csv(index=False), "candidates.csv")
+        st.download_button("Download Candidates", get_candidates_csv(), "candidates.csv")
     with col3:
         st.markdown("### Votes")
-        dfvotes = get_votes_csv()
-        st.download_button("Download Votes", dfvotes.to_csv(index=False), "votes.csv")
+        st.download_button("Download Votes", get_votes_csv(), "votes.csv")
+
+    # Parquet files are only built when asked for, not on every admin rerun.
+    # A checkbox keeps them available across the rerun each download triggers.
+    if st.checkbox("Prepare Parquet Downloads"):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.download_button("Volunteers (Parquet)", get_volunteers_parquet(), "volunteers.parquet")
+        with col2:
+            st.download_button("Candidates (Parquet)", get_candidates_parquet(), "candidates.parquet")
+        with col3:
+            st.download_button("Votes (Parquet)", get_votes_parquet(), "votes.parquet")
 
     # Remove Volunteers or Candidates
     st.subheader("🗑️ Remove Volunteer or Candidate")
 
-    volunteers = get_all_volunteers().to_dict(orient='records')
-    candidates = get_all_candidates().to_dict(orient='records')
-
     st.markdown("**Volunteers:**")
-    vol_rolls = [v['roll_number'] for v in volunteers]
+    vol_rolls = list_volunteer_rolls()
     vol_to_remove = st.selectbox("Select Volunteer Roll Number to Remove", [""] + vol_rolls)
     if st.button("Remove Volunteer") and vol_to_remove:
         remove_volunteer(vol_to_remove)
@@ -317,8 +742,9 @@ def admin_panel_page():
         st.rerun()
 
     st.markdown("**Candidates:**")
-    cand_rolls = [c['roll_number'] for c in candidates]
-    cand_to_remove = st.selectbox("Select Candidate Roll Number to Remove", [""] + cand_rolls)
+    cand_labels = list_candidate_labels()
+    cand_to_remove = st.selectbox("Select Candidate to Remove", [""] + list(cand_labels),
+                                  format_func=lambda roll: f"{roll} - {cand_labels[roll]}" if roll else "")
     if st.button("Remove Candidate") and cand_to_remove:
         remove_candidate(cand_to_remove)
         st.success(f"Removed candidate with roll {cand_to_remove}")
@@ -337,13 +763,20 @@ def volunteer_login_page():
     st.title("🗳️ NSS Election System - Volunteer Login")
     roll = st.text_input("Enter Your Roll Number")
     if st.button("Login"):
-        volunteer = get_volunteer_by_roll(roll)
-        if volunteer:
+        roll = roll.strip()
+        # Older databases may hold a blank roll, which an empty box would match
+        matches = get_volunteers_by_roll(roll) if roll else []
+        if not roll:
+            st.error("Please enter your roll number.")
+        elif len(matches) == 1:
+            volunteer = matches[0]
             st.session_state.volunteer_logged_in = True
             st.session_state.volunteer_id = volunteer['id']
             st.session_state.volunteer_name = volunteer['name']
             st.success(f"Welcome {volunteer['name']}!")
             st.rerun()
+        elif matches:
+            st.error("This roll number is registered more than once. Please contact the admin.")
         else:
             st.error("Volunteer not found. Please check your roll number.")
 
@@ -353,34 +786,28 @@ def volunteer_login_page():
 def voting_page():
     st.title(f"🗳️ Vote Now, {st.session_state.volunteer_name}")
 
-    positions = get_unique_positions()
+    ballot = get_ballot()
+
+    positions = list(ballot)
     if not positions:
         st.warning("No positions found. Contact admin.")
         return
 
+    # A form batches the radio choices, so picking a candidate doesn't rerun the page
     votes = {}
-    for pos in positions:
-        # Fetch candidates for this position
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("SELECT id, name, roll_number FROM candidates WHERE position1=? OR position2=?", (pos, pos))
-        candidates = c.fetchall()
-        conn.close()
-
-        options = {f"{cand['name']} ({cand['roll_number']})": cand['id'] for cand in candidates}
-        choice = st.radio(f"Select candidate for position: {pos}", options.keys())
-        votes[pos] = options[choice]
-
-    if st.button("Submit Vote"):
-        # Check if volunteer has voted for any position
-        already_voted_positions = [pos for pos in positions if has_voted(st.session_state.volunteer_id, pos)]
-
+    with st.form("ballot_form"):
+        for pos in positions:
+            candidates = ballot[pos]
+            options = {f"{cand['name']} ({cand['roll_number']})": cand['id'] for cand in candidates}
+            choice = st.radio(f"Select candidate for position: {pos}", options.keys())
+            votes[pos] = options[choice]
+        submitted = st.form_submit_button("Submit Vote")
+
+    if submitted:
+        already_voted_positions = submit_ballot(st.session_state.volunteer_id, votes)
         if already_voted_positions:
             st.error(f"You have already voted for position(s): {', '.join(already_voted_positions)}")
         else:
-            # Submit votes
-            for pos, candidate_id in votes.items():
-                submit_vote(st.session_state.volunteer_id, candidate_id, pos)
             st.success("Thank you! Your votes have been submitted.")
             # Logout volunteer after voting
             st.session_state.volunteer_logged_in = False
@@ -432,6 +859,5 @@ def main():
 # ----------------------------------
 if __name__ == "__main__":
     init_session_state()
-    create_tables()
-    create_admin()
+    init_db()
     main()